@@ -4,6 +4,7 @@ from app.routes.profile import profile_bp
 from app.routes.routine import routine_bp
 from app.routes.products import products_bp
 from app.routes.health import health_bp
+from app.utils import deadline
 def create_app():
     app = Flask(__name__)
     app.register_blueprint(auth_bp)
@@ -11,5 +12,6 @@ def create_app():
     app.register_blueprint(routine_bp)
     app.register_blueprint(products_bp)
     app.register_blueprint(health_bp)
+    deadline.init_app(app)
 
     return app
\ No newline at end of file
@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
 from app.utils.firebase import firebase_auth, firestore_client
+from app.utils.deadline import call_timeout, TIMEOUT_ERRORS
 from google.cloud import firestore
 
 auth_bp = Blueprint("auth", __name__, url_prefix="/api")
@@ -25,8 +26,10 @@ def login():
             "email": email,
             "name": name,
             "lastLogin": firestore.SERVER_TIMESTAMP
-        }, merge=True)
+        }, merge=True, timeout=call_timeout())
 
         return jsonify({"message": "Welcome!", "uid": uid}), 200
+    except TIMEOUT_ERRORS:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 401
@@ -1,4 +1,5 @@
 from flask import Blueprint, jsonify
+from app.utils.deadline import stats
 
 health_bp = Blueprint('health', __name__)
 
@@ -6,3 +7,8 @@ health_bp = Blueprint('health', __name__)
 def health_check():
     return jsonify({'status': 'ok'}), 200
 
+@health_bp.route('/health/load', methods=['GET'])
+def load_stats():
+    # per-worker debug view (resets on restart); fleet-wide counts come from the
+    # "Shed request" log lines
+    return jsonify(stats()), 200
@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
 from app.utils.firebase import firebase_auth, firestore_client
+from app.utils.deadline import call_timeout, TIMEOUT_ERRORS
 from google.cloud.firestore_v1 import SERVER_TIMESTAMP
 
 products_bp = Blueprint("products", __name__, url_prefix="/api")
@@ -15,6 +16,8 @@ def get_products():
     try:
         decoded_token = firebase_auth.verify_id_token(id_token)
         uid = decoded_token["uid"]
+    except TIMEOUT_ERRORS:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 401
 
@@ -22,7 +25,7 @@ def get_products():
         user_links = list(
             firestore_client.collection("user_products")
             .where("uid", "==", uid)
-            .stream()
+            .stream(timeout=call_timeout())
         )
         product_ids = list({
             doc.to_dict().get("product_id")
@@ -32,7 +35,7 @@ def get_products():
 
         products = []
         for pid in product_ids:
-            doc = firestore_client.collection("products").document(pid).get()
+            doc = firestore_client.collection("products").document(pid).get(timeout=call_timeout())
             if doc.exists:
                 product_data = doc.to_dict()
                 product_data["id"] = pid
@@ -40,6 +43,8 @@ def get_products():
 
         return jsonify({"products": products}), 200
 
+    except TIMEOUT_ERRORS:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -54,12 +59,14 @@ def get_product(product_id):
     try:
         decoded_token = firebase_auth.verify_id_token(id_token)
         uid = decoded_token["uid"]
+    except TIMEOUT_ERRORS:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 401
 
     try:
         product_ref = firestore_client.collection("products").document(product_id)
-        product = product_ref.get()
+        product = product_ref.get(timeout=call_timeout())
 
         if not product.exists:
             return jsonify({"error": "Product not found"}), 404
@@ -68,6 +75,8 @@ def get_product(product_id):
         product_data["id"] = product_id
         return jsonify({"product": product_data}), 200
 
+    except TIMEOUT_ERRORS:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -82,6 +91,8 @@ def add_product():
     try:
         decoded_token = firebase_auth.verify_id_token(id_token)
         uid = decoded_token["uid"]
+    except TIMEOUT_ERRORS:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 401
 
@@ -97,7 +108,7 @@ def add_product():
         # Step 1: Check if product exists
         products_ref = firestore_client.collection("products")
         query = products_ref.where("name", "==", name).where("category", "==", category).limit(1)
-        result = query.stream()
+        result = query.stream(timeout=call_timeout())
         product_doc = next(result, None)
 
         if product_doc:
@@ -109,7 +120,7 @@ def add_product():
                 "name": name,
                 "category": category,
                 "brand": brand
-            })
+            }, timeout=call_timeout())
             product_id = new_product_ref.id
 
         # Step 3: Link product to user (ensure unique document per uid-product)
@@ -117,15 +128,17 @@ def add_product():
         link_doc_id = f"{uid}_{product_id}"
         link_doc = user_products_ref.document(link_doc_id)
 
-        if not link_doc.get().exists:
+        if not link_doc.get(timeout=call_timeout()).exists:
             link_doc.set({
                 "uid": uid,
                 "product_id": product_id,
                 "added_at": SERVER_TIMESTAMP
-            })
+            }, timeout=call_timeout())
 
         return jsonify({"message": "Product added/linked successfully", "product_id": product_id}), 201
 
+    except TIMEOUT_ERRORS:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -139,6 +152,8 @@ def delete_product(product_id):
     try:
         decoded_token = firebase_auth.verify_id_token(id_token)
         uid = decoded_token["uid"]
+    except TIMEOUT_ERRORS:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 401
 
@@ -148,11 +163,13 @@ def delete_product(product_id):
         link_doc_id = f"{uid}_{product_id}"
         link_doc = user_products_ref.document(link_doc_id)
 
-        if link_doc.get().exists:
-            link_doc.delete()
+        if link_doc.get(timeout=call_timeout()).exists:
+            link_doc.delete(timeout=call_timeout())
             return jsonify({"message": "Product unlinked from user successfully"}), 200
         else:
             return jsonify({"error": "Product link not found for user"}), 404
 
+    except TIMEOUT_ERRORS:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
\ No newline at end of file
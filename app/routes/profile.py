@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
 from app.utils.firebase import firebase_auth, firestore_client
+from app.utils.deadline import call_timeout, TIMEOUT_ERRORS
 
 profile_bp = Blueprint("profile", __name__, url_prefix="/api")
 
@@ -13,6 +14,8 @@ def save_profile():
     try:
         decoded_token = firebase_auth.verify_id_token(id_token)
         uid = decoded_token["uid"]
+    except TIMEOUT_ERRORS:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 401
 
@@ -35,8 +38,10 @@ def save_profile():
                 "allergies": allergies,
                 "additionalNotes": additional
             }
-        }, merge=True)
+        }, merge=True, timeout=call_timeout())
         print(f"Saved profile for user {uid}")
         return jsonify({"message": "Profile saved"}), 200
+    except TIMEOUT_ERRORS:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -2,10 +2,16 @@
 from flask import Blueprint, request, jsonify
 import os, json, requests
 from app.utils.firebase import firebase_auth, firestore_client
+from app.utils.deadline import call_timeout, TIMEOUT_ERRORS
+from app.utils.status_buffer import status_buffer
 from google.cloud import firestore
 from datetime import datetime, timedelta
 
 API_KEY = os.getenv("GEMINI_API_KEY")
+# don't start a Gemini call we can't realistically wait for
+GEMINI_MIN_BUDGET_S = float(os.getenv("GEMINI_MIN_BUDGET_MS", "3000")) / 1000.0
+# held back from the Gemini timeout so the plan can still be saved afterwards
+GEMINI_RESERVE_S = float(os.getenv("GEMINI_RESERVE_MS", "1500")) / 1000.0
 API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent"
 
 routine_bp = Blueprint("routine", __name__, url_prefix="/api")
@@ -20,6 +26,8 @@ def _bearer_uid_or_401():
     try:
         decoded = firebase_auth.verify_id_token(id_token)
         return decoded["uid"], None
+    except TIMEOUT_ERRORS:
+        raise
     except Exception as e:
         return None, (jsonify({"error": str(e)}), 401)
 
@@ -64,6 +72,23 @@ def _status_doc_id(uid, date_str):
 def _status_doc(date_str, uid):
     return firestore_client.collection("user_routine_status").document(_status_doc_id(uid, date_str))
 
+def _load_status(date_str, uid, default):
+    # grab this worker's unflushed toggles before the read so a flush landing
+    # in between can't fall through the gap
+    pending = status_buffer.snapshot(_status_doc_id(uid, date_str)) if status_buffer else []
+    snap = _status_doc(date_str, uid).get(timeout=call_timeout())
+    status = snap.to_dict() if snap.exists else default
+    if pending:
+        status = status_buffer.overlay(status, pending)
+    return status
+
+def _save_status(date_str, uid, status, slot, product_id, applied):
+    status_ref = _status_doc(date_str, uid)
+    if status_buffer:
+        status_buffer.record(status_ref, {"uid": uid, "date": date_str}, slot, product_id, applied)
+    else:
+        status_ref.set(status, timeout=call_timeout())
+
 # ----------------------------- OpenAI helper (unchanged) -----------------------------
 def create_routine_openai(products):
     product_list = "\n".join([f"- {p.get('name', 'Unknown Product')}" for p in products])
@@ -86,11 +111,13 @@ def create_routine_openai(products):
     payload = {"contents":[{"parts":[{"text": user_query}]}],
                "generationConfig":{"responseMimeType":"application/json","responseSchema":response_schema}}
     try:
-        resp = requests.post(f"{API_URL}?key={API_KEY}", json=payload)
+        resp = requests.post(f"{API_URL}?key={API_KEY}", json=payload, timeout=call_timeout(GEMINI_MIN_BUDGET_S, reserve=GEMINI_RESERVE_S))
         resp.raise_for_status()
         result = resp.json()
         generated_text = result["candidates"][0]["content"]["parts"][0]["text"]
         return json.loads(generated_text)
+    except requests.exceptions.Timeout:
+        raise
     except requests.exceptions.RequestException as e:
         print(f"API request failed: {e}")
         return {"error": "Failed to generate routine from API."}
@@ -116,7 +143,7 @@ def save_routine():
             return jsonify({"error": "products must be a list"}), 400
 
         doc_ref = _routine_doc(uid)
-        snap = doc_ref.get()
+        snap = doc_ref.get(timeout=call_timeout())
         current = _normalize_routine(snap.to_dict())
 
         new_routine = {
@@ -132,8 +159,10 @@ def save_routine():
             "plan": current.get("plan", {}),  # preserve plan unless caller overwrites explicitly
         }
 
-        doc_ref.set(new_routine)
+        doc_ref.set(new_routine, timeout=call_timeout())
         return jsonify({"message": "Routine saved", "routine": new_routine}), 200
+    except TIMEOUT_ERRORS:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -148,19 +177,21 @@ def get_routine():
     if err: return err
     try:
         doc_ref = _routine_doc(uid)
-        snap = doc_ref.get()
+        snap = doc_ref.get(timeout=call_timeout())
 
         if not snap.exists:
             # migrate from legacy users.{routine} if present
-            legacy = firestore_client.collection("users").document(uid).get().to_dict() or {}
+            legacy = firestore_client.collection("users").document(uid).get(timeout=call_timeout()).to_dict() or {}
             legacy_norm = _normalize_routine(legacy.get("routine"))
             if legacy.get("routine"):
-                doc_ref.set(legacy_norm)
+                doc_ref.set(legacy_norm, timeout=call_timeout())
             routine = legacy_norm
         else:
             routine = _normalize_routine(snap.to_dict())
 
         return jsonify({"routine": routine}), 200
+    except TIMEOUT_ERRORS:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -179,7 +210,7 @@ def add_product_to_routine(product_id):
 
     try:
         doc_ref = _routine_doc(uid)
-        snap = doc_ref.get()
+        snap = doc_ref.get(timeout=call_timeout())
         routine = _normalize_routine(snap.to_dict())
 
         ids = { (p.get("id") or "").strip() for p in routine["products"][slot] }
@@ -187,8 +218,10 @@ def add_product_to_routine(product_id):
             return jsonify({"error": "Product already in this slot"}), 400
 
         routine["products"][slot].append({"id": product_id})
-        doc_ref.set(routine)
+        doc_ref.set(routine, timeout=call_timeout())
         return jsonify({"message": "Product added", "routine": routine}), 200
+    except TIMEOUT_ERRORS:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -209,7 +242,7 @@ def delete_product_from_routine(product_id):
 
     try:
         doc_ref = _routine_doc(uid)
-        snap = doc_ref.get()
+        snap = doc_ref.get(timeout=call_timeout())
         routine = _normalize_routine(snap.to_dict())
 
         def _strip(arr):
@@ -221,8 +254,10 @@ def delete_product_from_routine(product_id):
             routine["products"]["am"] = _strip(routine["products"]["am"])
             routine["products"]["pm"] = _strip(routine["products"]["pm"])
 
-        doc_ref.set(routine)
+        doc_ref.set(routine, timeout=call_timeout())
         return jsonify({"message": "Product removed", "routine": routine}), 200
+    except TIMEOUT_ERRORS:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -236,18 +271,18 @@ def generate_routine():
     if err: return err
     try:
         # Gather products from either user_products join or embedded somewhere else
-        user_doc = firestore_client.collection("users").document(uid).get()
+        user_doc = firestore_client.collection("users").document(uid).get(timeout=call_timeout())
         user_data = user_doc.to_dict() or {}
         products_info = user_data.get("products", [])
 
         if not products_info:
             links = list(
-                firestore_client.collection("user_products").where("uid", "==", uid).stream()
+                firestore_client.collection("user_products").where("uid", "==", uid).stream(timeout=call_timeout())
             )
             product_ids = [d.to_dict().get("product_id") for d in links if d.to_dict().get("product_id")]
             products_info = []
             for pid in product_ids:
-                pdoc = firestore_client.collection("products").document(pid).get()
+                pdoc = firestore_client.collection("products").document(pid).get(timeout=call_timeout())
                 if pdoc.exists:
                     pd = pdoc.to_dict()
                     products_info.append({
@@ -260,21 +295,25 @@ def generate_routine():
         if not products_info:
             return jsonify({"error": "No products found to generate a routine from."}), 400
 
+        # read before Gemini so only the final write has to fit after it
+        doc_ref = _routine_doc(uid)
+        snap = doc_ref.get(timeout=call_timeout())
+        routine = _normalize_routine(snap.to_dict())
+
         generated_plan = create_routine_openai(products_info)
         if "error" in generated_plan:
             return jsonify(generated_plan), 500
 
-        doc_ref = _routine_doc(uid)
-        snap = doc_ref.get()
-        routine = _normalize_routine(snap.to_dict())
         routine["plan"] = generated_plan
-        doc_ref.set(routine)
+        doc_ref.set(routine, timeout=call_timeout())
         print(f"Generated routine for user {uid}: {generated_plan}")
         return jsonify({
             "message": "New routine generated and saved.",
             "routine": generated_plan        
         }), 200
 
+    except TIMEOUT_ERRORS:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -297,13 +336,13 @@ def mark_product_applied():
     date_str = (data.get("date") or _today_date_str()).strip()
 
     try:
-        status_ref = _status_doc(date_str, uid)
-        status_doc = status_ref.get()
-        status = status_doc.to_dict() if status_doc.exists else {"uid": uid, "date": date_str, "am": [], "pm": []}
+        status = _load_status(date_str, uid, {"uid": uid, "date": date_str, "am": [], "pm": []})
         if product_id not in status.get(slot, []):
             status.setdefault(slot, []).append(product_id)
-        status_ref.set(status)
+        _save_status(date_str, uid, status, slot, product_id, True)
         return jsonify({"message": "Product marked as applied", "status": status}), 200
+    except TIMEOUT_ERRORS:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -319,12 +358,12 @@ def unmark_product_applied():
     if not product_id: return jsonify({"error":"Missing product_id"}), 400
 
     try:
-        status_ref = firestore_client.collection("user_routine_status").document(f"{uid}_{date_str}")
-        status_doc = status_ref.get()
-        status = status_doc.to_dict() if status_doc.exists else {"uid": uid, "date": date_str, "am": [], "pm": []}
+        status = _load_status(date_str, uid, {"uid": uid, "date": date_str, "am": [], "pm": []})
         status[slot] = [pid for pid in status.get(slot, []) if pid != product_id]
-        status_ref.set(status)
+        _save_status(date_str, uid, status, slot, product_id, False)
         return jsonify({"message": "Product unmarked", "status": status}), 200
+    except TIMEOUT_ERRORS:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -338,11 +377,10 @@ def get_today_routine_status():
     if err: return err
     date_str = (request.args.get("date") or _today_date_str()).strip()
     try:
-        routine = _normalize_routine(_routine_doc(uid).get().to_dict())
+        routine = _normalize_routine(_routine_doc(uid).get(timeout=call_timeout()).to_dict())
         products = routine["products"]
 
-        status_doc = _status_doc(date_str, uid).get()
-        status = status_doc.to_dict() if status_doc.exists else {"am": [], "pm": []}
+        status = _load_status(date_str, uid, {"am": [], "pm": []})
 
         def _completion(slot):
             total = len(products[slot])
@@ -355,6 +393,8 @@ def get_today_routine_status():
             "completion": {"am": _completion("am"), "pm": _completion("pm")},
             "routine": products
         }), 200
+    except TIMEOUT_ERRORS:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -373,13 +413,12 @@ def get_monthly_routine_status():
         month = int(request.args.get("month") or now.month)
         days = _month_range(year, month)
 
-        products = _normalize_routine(_routine_doc(uid).get().to_dict())["products"]
+        products = _normalize_routine(_routine_doc(uid).get(timeout=call_timeout()).to_dict())["products"]
 
         results = []
         for day in days:
             date_str = day.strftime("%Y-%m-%d")
-            sdoc = _status_doc(date_str, uid).get()
-            status = sdoc.to_dict() if sdoc.exists else {"am": [], "pm": []}
+            status = _load_status(date_str, uid, {"am": [], "pm": []})
 
             def _completion(slot):
                 total = len(products[slot])
@@ -393,5 +432,7 @@ def get_monthly_routine_status():
             })
 
         return jsonify({"month": f"{year}-{month:02d}", "days": results}), 200
+    except TIMEOUT_ERRORS:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
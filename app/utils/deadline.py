@@ -0,0 +1,167 @@
+# app/utils/deadline.py
+import os
+import time
+import threading
+import requests
+from flask import g, has_request_context, jsonify, request
+from google.api_core import exceptions as api_exceptions
+
+# Total time budget per request (seconds). An endpoint entry wins over its blueprint's,
+# which wins over the default. Override any of them with REQUEST_DEADLINE_<NAME>_S, e.g.
+# REQUEST_DEADLINE_ROUTINE_S=8 or REQUEST_DEADLINE_ROUTINE_GENERATE_ROUTINE_S=20.
+# Kept under gunicorn's default 30s worker timeout.
+DEFAULT_BUDGET_S = float(os.getenv("REQUEST_DEADLINE_S", "10"))
+BLUEPRINT_BUDGETS_S = {}
+ENDPOINT_BUDGETS_S = {
+    "routine.generate_routine": 25.0,  # waits on Gemini
+}
+
+# Clients may ask for a shorter (never longer) budget, in milliseconds.
+DEADLINE_HEADER = "X-Request-Deadline-Ms"
+
+# Don't start a downstream call with less than this left; shed with 503 instead.
+MIN_BUDGET_S = float(os.getenv("REQUEST_MIN_BUDGET_MS", "250")) / 1000.0
+
+# Shed new requests once this many are already in flight in this worker.
+# Default leaves one gunicorn thread free so health checks and 503s still get answered.
+MAX_INFLIGHT = int(os.getenv("MAX_INFLIGHT_REQUESTS") or max(1, int(os.getenv("GUNICORN_THREADS", "8")) - 1))
+
+# Blueprints that are never budgeted or shed.
+EXEMPT_BLUEPRINTS = {"health"}
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+# Errors that mean "ran out of time", ours or a downstream client's. Handlers re-raise
+# these past their catch-all so they reach the app error handler and become a 503.
+TIMEOUT_ERRORS = (
+    DeadlineExceeded,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.RetryError,
+    requests.exceptions.Timeout,
+)
+
+
+_lock = threading.Lock()
+_inflight = 0
+_stats = {"requests": 0, "shed_overload": 0, "shed_deadline": 0}
+
+
+def _env_budget(name):
+    env = os.getenv(f"REQUEST_DEADLINE_{(name or '').upper().replace('.', '_')}_S")
+    return float(env) if env else None
+
+
+def budget_for(blueprint, endpoint=None):
+    for name, table in ((endpoint, ENDPOINT_BUDGETS_S), (blueprint, BLUEPRINT_BUDGETS_S)):
+        if not name:
+            continue
+        budget = _env_budget(name)
+        if budget is None:
+            budget = table.get(name)
+        if budget is not None:
+            return budget
+    return DEFAULT_BUDGET_S
+
+
+def remaining():
+    """Seconds left for the current request, or None outside a budgeted request."""
+    if not has_request_context() or g.get("deadline") is None:
+        return None
+    return g.deadline - time.monotonic()
+
+
+def call_timeout(min_budget=MIN_BUDGET_S, reserve=0.0):
+    """
+    Timeout (seconds) to pass to a downstream call (Firestore, Gemini).
+    `reserve` is held back for calls that still have to run afterwards.
+    Raises DeadlineExceeded if less than `min_budget` would be left.
+    Returns None outside a request (e.g. background flushes) -> library default.
+    """
+    left = remaining()
+    if left is None:
+        return None
+    left -= reserve
+    if left < min_budget:
+        g.deadline_shed = True
+        raise DeadlineExceeded(f"Request deadline exceeded ({left:.3f}s left)")
+    return left
+
+
+def stats():
+    with _lock:
+        return dict(_stats, inflight=_inflight, max_inflight=MAX_INFLIGHT)
+
+
+def _shed_response(reason):
+    if reason == "deadline":
+        with _lock:
+            _stats["shed_deadline"] += 1
+    # counters above are per worker; this line is what Cloud Logging aggregates
+    left = remaining()
+    print(f"Shed request: reason={reason} blueprint={request.blueprint} endpoint={request.endpoint} "
+          f"remaining={'-' if left is None else f'{left:.3f}s'} inflight={_inflight}")
+    resp = jsonify({"error": "Server busy, try again shortly", "reason": reason})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = "1"
+    return resp
+
+
+def _before_request():
+    global _inflight
+    if request.blueprint in EXEMPT_BLUEPRINTS:
+        return None
+
+    budget = budget_for(request.blueprint, request.endpoint)
+    header = request.headers.get(DEADLINE_HEADER)
+    if header:
+        try:
+            budget = min(budget, max(0.0, float(header) / 1000.0))
+        except ValueError:
+            pass
+
+    with _lock:
+        _stats["requests"] += 1
+        overloaded = _inflight >= MAX_INFLIGHT
+        if overloaded:
+            _stats["shed_overload"] += 1
+        elif budget >= MIN_BUDGET_S:
+            _inflight += 1
+    if overloaded:
+        return _shed_response("overloaded")
+    if budget < MIN_BUDGET_S:
+        return _shed_response("deadline")
+
+    g.deadline_tracked = True
+    g.deadline = time.monotonic() + budget
+    return None
+
+
+def _handle_timeout(e):
+    g.pop("deadline_shed", None)
+    return _shed_response("deadline")
+
+
+def _after_request(response):
+    # call_timeout() refused a call but some handler swallowed the DeadlineExceeded
+    # (e.g. turned it into a 401/500); still report it as shed.
+    if g.pop("deadline_shed", False):
+        return _shed_response("deadline")
+    return response
+
+
+def _teardown_request(exc):
+    global _inflight
+    if g.pop("deadline_tracked", False):
+        with _lock:
+            _inflight -= 1
+
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    for exc in TIMEOUT_ERRORS:
+        app.register_error_handler(exc, _handle_timeout)
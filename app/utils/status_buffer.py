@@ -0,0 +1,201 @@
+# app/utils/status_buffer.py
+import os
+import time
+import atexit
+import copy
+import threading
+from google.api_core import exceptions as api_exceptions
+from google.cloud import firestore
+from app.utils.firebase import firestore_client
+
+# Opt-in: STATUS_WRITE_BEHIND=1 coalesces routine status toggles per
+# user_routine_status/{uid}_{date} doc and flushes the net change once per window.
+# The buffer lives in one process: a read served by another gunicorn worker or Cloud
+# Run instance won't see a toggle until it is flushed (up to one window later).
+# Only enable it with a single worker (WEB_CONCURRENCY=1) and session affinity,
+# or where that lag is acceptable.
+ENABLED = os.getenv("STATUS_WRITE_BEHIND", "").lower() in ("1", "true", "yes")
+WINDOW_S = float(os.getenv("STATUS_WRITE_BEHIND_WINDOW_MS", "1500")) / 1000.0
+# per-commit timeout, so one hung write can't hold its doc forever
+FLUSH_TIMEOUT_S = float(os.getenv("STATUS_FLUSH_TIMEOUT_MS", "5000")) / 1000.0
+# whole shutdown drain; keep it under the platform grace period (Cloud Run: 10s)
+SHUTDOWN_DRAIN_S = float(os.getenv("STATUS_SHUTDOWN_DRAIN_MS", "8000")) / 1000.0
+# failed flushes of the same change before it is dropped
+MAX_ATTEMPTS = 5
+
+# worth retrying; anything else (PermissionDenied, InvalidArgument, ...) is dropped at once
+TRANSIENT_ERRORS = (
+    api_exceptions.Aborted,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.InternalServerError,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.RetryError,
+    api_exceptions.ServiceUnavailable,
+)
+
+SLOTS = ("am", "pm")
+
+
+def _empty_changes():
+    return {slot: {"add": set(), "remove": set()} for slot in SLOTS}
+
+
+def _merge_changes(older, newer):
+    # newer toggles win over older ones for the same product
+    out = _empty_changes()
+    for slot in SLOTS:
+        out[slot]["add"] = (older[slot]["add"] - newer[slot]["remove"]) | newer[slot]["add"]
+        out[slot]["remove"] = (older[slot]["remove"] - newer[slot]["add"]) | newer[slot]["remove"]
+    return out
+
+
+def _apply_changes(status, changes):
+    for slot in SLOTS:
+        ids = [pid for pid in status.get(slot, []) if pid not in changes[slot]["remove"]]
+        ids += [pid for pid in sorted(changes[slot]["add"]) if pid not in ids]
+        status[slot] = ids
+    return status
+
+
+class StatusWriteBuffer:
+    """
+    Per-process write-behind buffer keyed by status doc id.
+    Holds the net change per slot (product ids added / removed), not a snapshot, and
+    flushes it with ArrayUnion/ArrayRemove so writes from other workers/instances
+    combine instead of overwriting each other. The first toggle for a doc schedules
+    a flush after `window` seconds; later toggles inside the window fold into it.
+    Only reads in this process see unflushed toggles (see ENABLED above).
+    """
+
+    def __init__(self, window, client):
+        self.window = window
+        self.client = client
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = {}   # doc_id -> (doc_ref, base, changes, attempts)
+        self._timers = {}    # doc_id -> threading.Timer
+        self._flushing = {}  # doc_id -> entry being written right now
+        self._closing = False
+
+    def record(self, doc_ref, base, slot, product_id, applied):
+        """Buffer one toggle. `base` holds the fields the doc is created with (uid, date)."""
+        change = _empty_changes()
+        change[slot]["add" if applied else "remove"].add(product_id)
+        doc_id = doc_ref.id
+        with self._lock:
+            entry = self._pending.get(doc_id)
+            changes = _merge_changes(entry[2], change) if entry else change
+            self._pending[doc_id] = (doc_ref, dict(base), changes, entry[3] if entry else 0)
+            self._schedule_locked(doc_id)
+            closing = self._closing
+        if closing:
+            # shutdown has started: no timers any more, write it now
+            self.flush(doc_id, deadline=time.monotonic() + FLUSH_TIMEOUT_S)
+
+    def snapshot(self, doc_id):
+        """
+        This process's unflushed changes for a doc. Take it *before* reading Firestore
+        and overlay() it after: a flush landing in between is then in both, which is
+        harmless since union/remove are idempotent.
+        """
+        with self._lock:
+            entries = (self._flushing.get(doc_id), self._pending.get(doc_id))
+            return [copy.deepcopy(e[2]) for e in entries if e]
+
+    def overlay(self, status, changes):
+        status = copy.deepcopy(status)
+        for c in changes:
+            _apply_changes(status, c)
+        return status
+
+    def flush(self, doc_id, deadline=None):
+        """
+        Write a doc's pending changes. Timer flushes (no deadline) back off while an
+        earlier write is in flight; shutdown flushes wait for it, up to `deadline`.
+        """
+        with self._lock:
+            self._timers.pop(doc_id, None)
+            if doc_id in self._flushing:
+                if deadline is None:
+                    # don't let the two land out of order
+                    self._schedule_locked(doc_id)
+                    return
+                self._idle.wait_for(lambda: doc_id not in self._flushing,
+                                    timeout=max(0.0, deadline - time.monotonic()))
+                if doc_id in self._flushing:
+                    return
+            entry = self._pending.pop(doc_id, None)
+            if not entry:
+                return
+            # stay visible to snapshot() until the write lands
+            self._flushing[doc_id] = entry
+        timeout = FLUSH_TIMEOUT_S
+        if deadline is not None:
+            timeout = max(0.001, min(timeout, deadline - time.monotonic()))
+        error = None
+        try:
+            self._write(entry[0], entry[1], entry[2], timeout)
+        except Exception as e:
+            error = e
+        dropped = False
+        with self._lock:
+            self._flushing.pop(doc_id, None)
+            if error is not None:
+                attempts = entry[3] + 1
+                if isinstance(error, TRANSIENT_ERRORS) and attempts < MAX_ATTEMPTS:
+                    # fold back in under any newer toggles that arrived while we were writing
+                    newer = self._pending.get(doc_id)
+                    changes = _merge_changes(entry[2], newer[2]) if newer else entry[2]
+                    self._pending[doc_id] = (entry[0], entry[1], changes, attempts)
+                    self._schedule_locked(doc_id)
+                else:
+                    dropped = True
+            self._idle.notify_all()
+        if dropped:
+            print(f"Dropping routine status change for {doc_id} after {entry[3] + 1} attempt(s): {error}")
+        elif error is not None:
+            print(f"Status flush failed for {doc_id}, will retry: {error}")
+
+    def flush_all(self):
+        """Drain everything at worker shutdown, bounded by SHUTDOWN_DRAIN_S overall."""
+        deadline = time.monotonic() + SHUTDOWN_DRAIN_S
+        with self._lock:
+            self._closing = True
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+        while True:
+            with self._lock:
+                doc_ids = list(self._pending)
+            if not doc_ids:
+                return
+            if time.monotonic() >= deadline:
+                print(f"Dropping unflushed routine status for {sorted(doc_ids)}")
+                return
+            for doc_id in doc_ids:
+                self.flush(doc_id, deadline=deadline)
+
+    def _write(self, doc_ref, base, changes, timeout):
+        adds = {slot: firestore.ArrayUnion(sorted(c["add"])) for slot, c in changes.items() if c["add"]}
+        removes = {slot: firestore.ArrayRemove(sorted(c["remove"])) for slot, c in changes.items() if c["remove"]}
+        # one field can't carry both transforms in a single write; a batch keeps them atomic
+        batch = self.client.batch()
+        batch.set(doc_ref, {**base, **adds}, merge=True)
+        if removes:
+            batch.set(doc_ref, removes, merge=True)
+        batch.commit(timeout=timeout)
+
+    def _schedule_locked(self, doc_id):
+        if self._closing or doc_id in self._timers:
+            return
+        timer = threading.Timer(self.window, self.flush, args=(doc_id,))
+        timer.daemon = True
+        self._timers[doc_id] = timer
+        timer.start()
+
+
+status_buffer = StatusWriteBuffer(WINDOW_S, firestore_client) if ENABLED else None
+
+if status_buffer:
+    # gunicorn workers exit via sys.exit on graceful shutdown, so atexit runs
+    atexit.register(status_buffer.flush_all)